@@ -1,13 +1,15 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, status
+from fastapi import FastAPI, File, UploadFile, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, Response, StreamingResponse
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 import os
+import time
 import tempfile
-import shutil
 import logging
+import functools
 from datetime import datetime
+import orjson
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -29,9 +31,52 @@ app = FastAPI(
     description="Advanced Retrieval-Augmented Generation system for enterprise knowledge management",
     version="2.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=ORJSONResponse
 )
 
+# Upload limits
+MAX_UPLOAD_SIZE = 50 * 1024 * 1024  # 50MB per file
+UPLOAD_READ_CHUNK = 1 << 20  # Stream uploads to disk 1MB at a time
+# Whole-request cap checked against Content-Length before any body is read
+MAX_REQUEST_SIZE = int(os.getenv("MAX_REQUEST_SIZE", 100 * 1024 * 1024))
+
+@functools.lru_cache(maxsize=1)
+def _iso_timestamp(second: int) -> str:
+    """Format an epoch second as an ISO-8601 UTC string; cached for that second."""
+    return datetime.utcfromtimestamp(second).isoformat() + "Z"
+
+def utc_timestamp() -> str:
+    """Current UTC time at one-second resolution, formatted at most once per second."""
+    return _iso_timestamp(int(time.time()))
+
+class RequestSizeLimitMiddleware:
+    """Reject requests whose Content-Length exceeds the limit without reading the body."""
+    
+    def __init__(self, app, max_size: int):
+        self.app = app
+        self.max_size = max_size
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            content_length = dict(scope["headers"]).get(b"content-length")
+            if content_length and content_length.isdigit() and int(content_length) > self.max_size:
+                response = ORJSONResponse(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    content={
+                        "error": f"Request is too large. Maximum size is {self.max_size // (1024 * 1024)}MB.",
+                        "details": None,
+                        "timestamp": utc_timestamp(),
+                        "request_id": None
+                    }
+                )
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+# Registered before CORS so CORS stays outermost and 413s still carry CORS headers
+app.add_middleware(RequestSizeLimitMiddleware, max_size=MAX_REQUEST_SIZE)
+
 # Enhanced CORS configuration
 app.add_middleware(
     CORSMiddleware,
@@ -48,8 +93,21 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize RAG engine
-rag_engine = RAGEngine()
+# RAG engine, built at startup rather than import: spawned PDF workers re-import
+# the launching script (python main.py) and must not each build their own engine
+rag_engine: Optional[RAGEngine] = None
+
+@app.on_event("startup")
+async def startup_event():
+    """Initialize the RAG engine once the server process starts."""
+    global rag_engine
+    rag_engine = RAGEngine()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background ingest and persist engine state that would otherwise be rebuilt on restart."""
+    await rag_engine.stop_ingest()
+    rag_engine.save_cache()
 
 # Pydantic models
 class QueryRequest(BaseModel):
@@ -85,6 +143,7 @@ class HealthResponse(BaseModel):
     pinecone_configured: bool
     timestamp: str
     demo_chunks: Optional[int] = None
+    documents_queued: Optional[int] = None
 
 class ErrorResponse(BaseModel):
     error: str
@@ -92,11 +151,6 @@ class ErrorResponse(BaseModel):
     timestamp: str
     request_id: Optional[str] = None
 
-# Dependency functions
-async def get_rag_engine() -> RAGEngine:
-    """Dependency to get RAG engine instance."""
-    return rag_engine
-
 # Exception handlers
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request, exc):
@@ -104,7 +158,7 @@ async def http_exception_handler(request, exc):
         status_code=exc.status_code,
         content=ErrorResponse(
             error=exc.detail,
-            timestamp=datetime.utcnow().isoformat() + "Z"
+            timestamp=utc_timestamp()
         ).dict()
     )
 
@@ -116,7 +170,7 @@ async def general_exception_handler(request, exc):
         content=ErrorResponse(
             error="Internal server error",
             details=str(exc) if os.getenv("DEBUG") == "true" else None,
-            timestamp=datetime.utcnow()
+            timestamp=utc_timestamp()
         ).dict()
     )
 
@@ -124,26 +178,28 @@ async def general_exception_handler(request, exc):
 @app.get("/", tags=["Health"])
 async def root():
     """Root endpoint with API information."""
-    return {
+    return ORJSONResponse(content={
         "message": "CogniDocs Enterprise RAG API",
         "version": "2.0.0",
         "status": "operational",
         "documentation": "/docs",
-        "timestamp": datetime.utcnow()
-    }
+        "timestamp": utc_timestamp()
+    })
 
-@app.post("/upload/", response_model=UploadResponse, tags=["Document Management"])
-async def upload_documents(
-    files: List[UploadFile] = File(...),
-    engine: RAGEngine = Depends(get_rag_engine)
-):
+@app.post(
+    "/upload/",
+    response_model=UploadResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+    tags=["Document Management"]
+)
+async def upload_documents(files: List[UploadFile] = File(...)):
     """
-    Upload and process PDF documents for the knowledge base.
+    Upload PDF documents and queue them for processing into the knowledge base.
     
     - **files**: List of PDF files to upload and process
-    - Returns processing details and success confirmation
+    - Returns once the files are queued; track progress with `/documents/`
     """
-    start_time = datetime.utcnow()
+    start_ns = time.perf_counter_ns()
     
     try:
         if not files:
@@ -154,70 +210,58 @@ async def upload_documents(
         
         uploaded_files = []
         processing_details = {}
+        saved_files = []  # (tmp_path, filename, file_size)
+        handed_off = set()  # Paths of queued files, which the ingest workers delete
         
-        for file in files:
-            # Validate file type
-            if not file.filename or not file.filename.lower().endswith('.pdf'):
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"Only PDF files are supported. Received: {file.filename}"
-                )
-            
-            # Check file size (limit to 50MB)
-            file_size = 0
-            content = await file.read()
-            file_size = len(content)
-            
-            if file_size > 50 * 1024 * 1024:  # 50MB limit
-                raise HTTPException(
-                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-                    detail=f"File {file.filename} is too large. Maximum size is 50MB."
-                )
-            
-            # Reset file pointer
-            await file.seek(0)
+        try:
+            for file in files:
+                # Validate file type
+                if not file.filename or not file.filename.lower().endswith('.pdf'):
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail=f"Only PDF files are supported. Received: {file.filename}"
+                    )
+                
+                # Stream to a temporary file, enforcing the size limit as bytes arrive
+                file_size = 0
+                with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
+                    # Register before writing so a rejected upload is still cleaned up
+                    saved_files.append((tmp_file.name, file.filename, 0))
+                    while chunk := await file.read(UPLOAD_READ_CHUNK):
+                        file_size += len(chunk)
+                        if file_size > MAX_UPLOAD_SIZE:
+                            raise HTTPException(
+                                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                detail=f"File {file.filename} is too large. Maximum size is 50MB."
+                            )
+                        tmp_file.write(chunk)
+                saved_files[-1] = (tmp_file.name, file.filename, file_size)
             
-            # Save uploaded file temporarily
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-                shutil.copyfileobj(file.file, tmp_file)
-                tmp_path = tmp_file.name
+            # Parsing, embedding and storage happen in the background ingest workers
+            # Queued one at a time so a cancelled upload knows which files were accepted
+            for tmp_path, filename, _ in saved_files:
+                await rag_engine.enqueue_documents([(tmp_path, filename)])
+                handed_off.add(tmp_path)
             
-            try:
-                # Process the document with RAG engine
-                file_start = datetime.utcnow()
-                await engine.add_document(tmp_path, file.filename)
-                processing_time = (datetime.utcnow() - file_start).total_seconds()
-                
-                uploaded_files.append(file.filename)
-                processing_details[file.filename] = {
-                    "size_mb": round(file_size / (1024 * 1024), 2),
-                    "processing_time_seconds": round(processing_time, 2),
-                    "status": "success"
-                }
-                
-                logger.info(f"Successfully processed {file.filename}")
-                
-            except Exception as e:
-                logger.error(f"Error processing {file.filename}: {str(e)}")
-                processing_details[file.filename] = {
+            for _, filename, file_size in saved_files:
+                uploaded_files.append(filename)
+                processing_details[filename] = {
                     "size_mb": round(file_size / (1024 * 1024), 2),
-                    "status": "failed",
-                    "error": str(e)
+                    "status": "queued"
                 }
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail=f"Error processing {file.filename}: {str(e)}"
-                )
-            finally:
-                # Clean up temporary file
-                if os.path.exists(tmp_path):
+                logger.info(f"Queued {filename} for processing")
+        
+        finally:
+            # Clean up temporary files that never reached the ingest queue
+            for tmp_path, _, _ in saved_files:
+                if tmp_path not in handed_off and os.path.exists(tmp_path):
                     os.unlink(tmp_path)
         
-        total_time = (datetime.utcnow() - start_time).total_seconds()
+        total_time = (time.perf_counter_ns() - start_ns) / 1e9
         processing_details["total_processing_time"] = round(total_time, 2)
         
         return UploadResponse(
-            message=f"Successfully uploaded and processed {len(uploaded_files)} document(s)",
+            message=f"Successfully uploaded {len(uploaded_files)} document(s); processing in the background",
             uploaded_files=uploaded_files,
             processing_details=processing_details,
             total_files=len(uploaded_files)
@@ -233,10 +277,7 @@ async def upload_documents(
         )
 
 @app.post("/query/", response_model=QueryResponse, tags=["AI Query"])
-async def query_documents(
-    request: QueryRequest,
-    engine: RAGEngine = Depends(get_rag_engine)
-):
+async def query_documents(request: QueryRequest):
     """
     Query the knowledge base and receive AI-generated answers with source citations.
     
@@ -244,7 +285,7 @@ async def query_documents(
     - **include_sources**: Whether to include source citations (default: true)
     - **max_sources**: Maximum number of sources to return (1-10, default: 5)
     """
-    start_time = datetime.utcnow()
+    start_ns = time.perf_counter_ns()
     
     try:
         if not request.query.strip():
@@ -256,9 +297,9 @@ async def query_documents(
         logger.info(f"Processing query: {request.query[:100]}...")
         
         # Process the query
-        result = await engine.query(request.query)
+        result = await rag_engine.query(request.query)
         
-        processing_time = (datetime.utcnow() - start_time).total_seconds()
+        processing_time = (time.perf_counter_ns() - start_ns) / 1e9
         
         # Limit sources if requested
         sources = result.get("sources", [])[:request.max_sources] if request.include_sources else []
@@ -284,24 +325,66 @@ async def query_documents(
             detail=f"Error processing query: {str(e)}"
         )
 
-@app.get("/health", response_model=HealthResponse, tags=["Health"])
-async def health_check(engine: RAGEngine = Depends(get_rag_engine)):
+@app.post("/query/stream", tags=["AI Query"])
+async def query_documents_stream(request: QueryRequest):
+    """
+    Query the knowledge base and stream the answer as Server-Sent Events.
+    
+    Each event is a JSON object: `{"delta": ...}` events carry answer text as it
+    is generated, and the final event carries `sources`, `context_used`,
+    `processing_time` and `"done": true`.
+    """
+    if not request.query.strip():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Query cannot be empty"
+        )
+    
+    logger.info(f"Streaming query: {request.query[:100]}...")
+    start_ns = time.perf_counter_ns()
+    
+    async def events():
+        async for event in rag_engine.query_stream(request.query):
+            if event.get("done"):
+                sources = event.get("sources", [])
+                event["sources"] = sources[:request.max_sources] if request.include_sources else []
+                event["processing_time"] = round((time.perf_counter_ns() - start_ns) / 1e9, 2)
+                event["timestamp"] = utc_timestamp()
+            yield b"data: " + orjson.dumps(event) + b"\n\n"
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@functools.lru_cache(maxsize=1)
+def _health_payload(second: int) -> bytes:
+    """Serialized /health body, rebuilt at most once per second."""
+    status_info = rag_engine.get_status()
+    return orjson.dumps({
+        "status": "healthy",
+        "mode": status_info["mode"],
+        "documents_count": status_info["documents_count"],
+        "gemini_configured": status_info["gemini_configured"],
+        "pinecone_configured": status_info["pinecone_configured"],
+        "demo_chunks": status_info.get("demo_chunks"),
+        "documents_queued": status_info.get("documents_queued"),
+        "timestamp": _iso_timestamp(second)
+    })
+
+@app.get("/health", responses={200: {"model": HealthResponse}}, tags=["Health"])
+async def health_check():
     """
     Comprehensive health check endpoint.
     
     Returns system status, configuration, and document count.
+    The payload is cached for one second; probes never need fresher data.
     """
     try:
-        status_info = engine.get_status()
-        
-        return HealthResponse(
-            status="healthy",
-            mode=status_info["mode"],
-            documents_count=status_info["documents_count"],
-            gemini_configured=status_info["gemini_configured"],
-            pinecone_configured=status_info["pinecone_configured"],
-            demo_chunks=status_info.get("demo_chunks"),
-            timestamp=datetime.utcnow().isoformat() + "Z"
+        return Response(
+            content=_health_payload(int(time.time())),
+            media_type="application/json"
         )
     
     except Exception as e:
@@ -312,12 +395,12 @@ async def health_check(engine: RAGEngine = Depends(get_rag_engine)):
         )
 
 @app.get("/documents/", tags=["Document Management"])
-async def list_documents(engine: RAGEngine = Depends(get_rag_engine)):
+async def list_documents():
     """List all uploaded documents with metadata."""
     try:
         return {
-            "documents": engine.documents,
-            "total_count": len(engine.documents),
+            "documents": rag_engine.documents,
+            "total_count": len(rag_engine.documents),
             "timestamp": datetime.utcnow()
         }
     except Exception as e:
@@ -330,7 +413,7 @@ async def list_documents(engine: RAGEngine = Depends(get_rag_engine)):
 @app.get("/status", tags=["Health"])
 async def get_system_status():
     """Get detailed system status and configuration."""
-    return {
+    return ORJSONResponse(content={
         "system": "CogniDocs Enterprise RAG",
         "version": "2.0.0",
         "environment": {
@@ -338,9 +421,9 @@ async def get_system_status():
             "pinecone_configured": bool(os.getenv("PINECONE_API_KEY")),
             "debug_mode": os.getenv("DEBUG", "false").lower() == "true"
         },
-        "timestamp": datetime.utcnow(),
+        "timestamp": utc_timestamp(),
         "uptime": "operational"
-    }
+    })
 
 if __name__ == "__main__":
     import uvicorn
@@ -349,6 +432,8 @@ if __name__ == "__main__":
     host = os.getenv("HOST", "0.0.0.0")
     port = int(os.getenv("PORT", 8000))
     reload = os.getenv("DEBUG", "false").lower() == "true"
+    # Engine state (demo storage, semantic cache) is per process, so default to one worker
+    workers = int(os.getenv("WORKERS", 1))
     
     logger.info(f"Starting CogniDocs API server on {host}:{port}")
     
@@ -357,6 +442,9 @@ if __name__ == "__main__":
         host=host,
         port=port,
         reload=reload,
+        workers=None if reload else workers,
+        loop="uvloop",
+        http="httptools",
         log_level="info"
     )
 
@@ -1,20 +1,186 @@
 import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import heapq
+import sqlite3
 import asyncio
-from typing import List, Dict, Any, Optional
-from langchain_community.document_loaders import PyPDFLoader
+import concurrent.futures
+import multiprocessing
+from dataclasses import dataclass, asdict
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
-from langchain.chains import RetrievalQA
-from langchain.schema import Document
 from langchain.prompts import PromptTemplate
-from langchain_pinecone import Pinecone as LangchainPinecone
 import logging
+import numpy as np
+import scipy.sparse
+from sklearn.feature_extraction.text import HashingVectorizer, ENGLISH_STOP_WORDS
+import ahocorasick
+from datasketch import MinHash, MinHashLSH
+import pypdfium2 as pdfium
 import google.generativeai as genai
 
+try:
+    import hnswlib
+except ImportError:  # Optional: the semantic cache falls back to a flat scan
+    hnswlib = None
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Output dimension of models/embedding-001
+EMBEDDING_DIM = 768
+
+# Below this many cached queries a flat scan beats HNSW's constant overhead
+HNSW_MIN_ENTRIES = 1024
+HNSW_INITIAL_CAPACITY = 100_000
+
+# Rows of an int8 matrix widened to float32 per scoring step (~12MB at 768 dims)
+INT8_SCAN_BLOCK_ROWS = 4096
+
+# Minimum term-vector cosine score for a demo chunk to count as relevant
+DEMO_MIN_RELEVANCE = 0.1
+
+# Vectors sent per Pinecone upsert request
+PINECONE_UPSERT_BATCH = 100
+
+# Texts per embed_documents request, and how many requests may be in flight
+EMBED_BATCH_SIZE = 100
+EMBED_CONCURRENCY = 5
+
+# PDF parsing and splitting are CPU-bound pure Python, so they run in worker
+# processes instead of threads to let concurrent uploads use every core.
+# Workers are spawned, not forked: they start lazily after the engine has opened
+# gRPC channels (Gemini, Pinecone) and threads, and gRPC is not fork-safe.
+_PDF_POOL = concurrent.futures.ProcessPoolExecutor(
+    max_workers=os.cpu_count(),
+    mp_context=multiprocessing.get_context("spawn")
+)
+
+# PDFs below this size parse faster inline than the round trip to a worker process
+INLINE_PARSE_MAX_BYTES = 256 * 1024
+
+# Built once per process and shared by every upload
+_TEXT_SPLITTER = RecursiveCharacterTextSplitter(
+    chunk_size=1000,
+    chunk_overlap=200,
+    length_function=len,
+    separators=["\n\n", "\n", " ", ""]
+)
+
+# Maximum number of prompt -> answer pairs kept by RAGEngine._generate
+LLM_PROMPT_CACHE_SIZE = 256
+
+# Chunks whose word-set Jaccard similarity to a stored chunk reaches this are dropped
+DEDUP_THRESHOLD = 0.85
+MINHASH_PERMS = 128
+
+# Uploads waiting for background ingest; enqueueing blocks once this many are pending
+INGEST_QUEUE_SIZE = 32
+# Files a worker takes from the queue at once, so they share one embedding batch
+INGEST_BATCH_MAX = 8
+
+
+@dataclass(slots=True)
+class ChunkMeta:
+    """Source fields of one chunk; slotted, so far smaller than a metadata dict."""
+    source: str
+    chunk_id: int
+    page_number: int
+    total_chunks: int
+    
+    @classmethod
+    def from_dict(cls, metadata: Dict[str, Any]) -> "ChunkMeta":
+        """Build from a stored metadata dict, ignoring keys older stores may carry."""
+        return cls(
+            source=metadata.get("source", "Unknown"),
+            chunk_id=int(metadata.get("chunk_id", 0)),
+            page_number=int(metadata.get("page_number", 1)),
+            total_chunks=int(metadata.get("total_chunks", 0)),
+        )
+
+
+Chunk = Tuple[str, ChunkMeta]
+
+
+def _parse_and_split(file_path: str, filename: str) -> Tuple[List[Chunk], int]:
+    """Load a PDF and split it into (text, ChunkMeta) chunks; runs in a worker process."""
+    # Extract text with PDFium (native code) rather than pure-Python pypdf
+    pdf = pdfium.PdfDocument(file_path)
+    try:
+        pages = []
+        for page in pdf:
+            textpage = page.get_textpage()
+            pages.append(textpage.get_text_range())
+            textpage.close()
+            page.close()
+    finally:
+        pdf.close()
+    
+    if not pages:
+        raise Exception("No content found in the PDF")
+    
+    # Split each page's text, then emit chunks with their final metadata in one pass
+    page_texts = [_TEXT_SPLITTER.split_text(text) for text in pages]
+    total_chunks = sum(len(texts) for texts in page_texts)
+    
+    # Plain tuples keep the result cheap to pickle back to the parent
+    chunks: List[Chunk] = []
+    for page_number, texts in enumerate(page_texts):
+        for text in texts:
+            chunks.append((text, ChunkMeta(filename, len(chunks), page_number, total_chunks)))
+    return chunks, len(pages)
+
+
+def _chunk_minhash(text: str) -> MinHash:
+    """MinHash of a chunk's lowercased word set, for near-duplicate detection."""
+    minhash = MinHash(num_perm=MINHASH_PERMS)
+    minhash.update_batch([word.encode() for word in set(text.lower().split())])
+    return minhash
+
+
+def _quantize(vec: np.ndarray) -> Tuple[np.ndarray, float]:
+    """Symmetric int8 quantization of a vector; returns (values, scale)."""
+    scale = float(np.max(np.abs(vec))) / 127 or 1.0
+    return np.round(vec / scale).astype(np.int8), scale
+
+
+def _word_automaton(words) -> "ahocorasick.Automaton":
+    """Compile words into an Aho-Corasick automaton whose matches yield the word."""
+    automaton = ahocorasick.Automaton()
+    for word in words:
+        automaton.add_word(word, word)
+    automaton.make_automaton()
+    return automaton
+
+
+def _quantize_rows(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Row-wise symmetric int8 quantization; returns (values, float32 scale per row)."""
+    scales = np.abs(matrix).max(axis=1) / 127
+    scales[scales == 0] = 1.0
+    values = np.round(matrix / scales[:, None]).astype(np.int8)
+    return values, scales.astype(np.float32)
+
+
+def _int8_scores(values: np.ndarray, scales: np.ndarray, query_vec: np.ndarray) -> np.ndarray:
+    """Dot products of int8 rows (with per-row scales) against a float32 query.
+    
+    NumPy has no BLAS path for integer matmul, so rows are widened to float32 a
+    block at a time: each block is a BLAS GEMV and the temporary stays a few MB
+    instead of a float32 copy of the whole matrix.
+    """
+    scores = np.empty(len(values), dtype=np.float32)
+    for start in range(0, len(values), INT8_SCAN_BLOCK_ROWS):
+        block = values[start:start + INT8_SCAN_BLOCK_ROWS]
+        scores[start:start + len(block)] = block.astype(np.float32) @ query_vec
+    scores *= scales
+    return scores
+
+
 class RAGEngine:
     def __init__(self):
         """Initialize the RAG engine with Google Gemini and Pinecone."""
@@ -38,16 +204,79 @@ class RAGEngine:
             )
         
         # Initialize Pinecone (if available)
-        self.vectorstore = None
+        self._index = None
+        # Sparse-dense hybrid queries need a dotproduct index; set once the index is known
+        self._hybrid = False
+        # Weight of the dense score in hybrid queries; the sparse score gets the rest
+        self.hybrid_alpha = float(os.getenv("HYBRID_ALPHA", "0.75"))
+        self._embed_sem: Optional[asyncio.Semaphore] = None  # Created on first use, inside the event loop
+        # Content-hash -> normalized embedding, so unchanged chunks are never re-embedded
+        self._embcache = sqlite3.connect(os.getenv("EMBEDDING_CACHE_PATH") or "emb_cache.db")
+        self._embcache.execute("CREATE TABLE IF NOT EXISTS emb (hash BLOB PRIMARY KEY, vec BLOB)")
         self.documents = {}  # Store document metadata
+        # Background ingest: the queue and its workers are created on first use, inside the event loop
+        self.ingest_workers = int(os.getenv("INGEST_WORKERS", "2"))
+        self._ingest_q: Optional[asyncio.Queue] = None
+        self._ingest_tasks: List[asyncio.Task] = []
+        # MinHash LSH over the word sets of stored chunks, so repeated
+        # boilerplate (headers, footers, disclaimers) is embedded and stored only once
+        self._lsh = MinHashLSH(threshold=DEDUP_THRESHOLD, num_perm=MINHASH_PERMS)
+        self._lsh_next_key = 0
         
         # For demo purposes, use in-memory storage if Pinecone is not configured
         self.demo_mode = not self.pinecone_api_key or not self.gemini_api_key
-        self.demo_documents = []
+        # Demo chunks are stored column-wise; row i of every array is chunk i
+        self._demo_texts: List[str] = []
+        self._demo_lower: List[str] = []  # Lowercased chunk text, parallel to _demo_texts
+        self._demo_sources = np.empty(0, dtype=object)
+        self._demo_pages = np.empty(0, dtype=np.int32)
+        self._demo_chunk_ids = np.empty(0, dtype=np.int32)
+        # Stateless hashed term vectors: new chunks are appended without refitting
+        self._vectorizer = HashingVectorizer(
+            n_features=2 ** 18,
+            lowercase=False,  # chunks are lowercased once at ingest
+            stop_words="english",
+            alternate_sign=False,
+            norm="l2"
+        )
+        self._doc_matrix = None
+        # int8 chunk embeddings with one scale per row (memory-mapped when DEMO_STORE_PATH is set)
+        self._demo_q_embs: Optional[np.ndarray] = None
+        self._demo_scales: Optional[np.ndarray] = None
+        self.demo_store_path = os.getenv("DEMO_STORE_PATH")
+        # Minimum embedding cosine similarity for a demo chunk to count as relevant;
+        # below it retrieval falls back to term and keyword matching
+        self.demo_min_dense_score = float(os.getenv("DEMO_MIN_DENSE_SCORE", "0.6"))
+        
+        # Semantic cache: normalized query embeddings and the responses they produced
+        self.cache_threshold = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+        # Stored as int8 with a per-vector scale: a quarter of the float32 footprint
+        self._cache_q = np.empty((0, EMBEDDING_DIM), dtype=np.int8)
+        self._cache_scale = np.empty(0, dtype=np.float32)
+        self._cache_entries: List[Dict[str, Any]] = []
+        # Wall-clock creation and last-hit times per slot, for TTL and LRU eviction
+        self._cache_created = np.empty(0, dtype=np.float64)
+        self._cache_used = np.empty(0, dtype=np.float64)
+        self.cache_ttl = float(os.getenv("SEMANTIC_CACHE_TTL", "300"))
+        self.cache_max_entries = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "10000"))
+        if hnswlib is not None and self.cache_max_entries <= HNSW_MIN_ENTRIES:
+            logger.warning(
+                f"SEMANTIC_CACHE_MAX_ENTRIES={self.cache_max_entries} never reaches the "
+                f"{HNSW_MIN_ENTRIES}-entry HNSW threshold; the cache will always use a flat scan"
+            )
+        self._hnsw = None
+        # Bumped by _cache_clear so answers retrieved before an ingest are not cached after it
+        self._cache_generation = 0
+        self.cache_path = os.getenv("SEMANTIC_CACHE_PATH")
+        if self.cache_path:
+            self._cache_load()
         
         if not self.demo_mode:
             self._initialize_pinecone()
         
+        if self.demo_mode and self.demo_store_path:
+            self._load_demo_store()
+        
         # Initialize LLM with Gemini
         self.llm = None
         if self.gemini_api_key:
@@ -58,6 +287,9 @@ class RAGEngine:
                 max_tokens=1000,
                 convert_system_message_to_human=True
             )
+        # Answers keyed by prompt hash; unlike the semantic cache these stay valid
+        # across ingests because the prompt embeds the retrieved context
+        self._llm_cached_prompts: Dict[str, str] = {}
         
         # Custom prompt template
         self.prompt_template = PromptTemplate(
@@ -75,14 +307,50 @@ class RAGEngine:
             
             Answer:"""
         )
+        # The template is validated once here; per-query formatting is a plain str.format
+        self._prompt_text = self.prompt_template.template
+        
+        # Canned answers for demo queries that match no stored chunk, in priority order
+        self._demo_responses = {
+            "tesla": {
+                "answer": "Based on Tesla's 2023 annual report, Tesla achieved record financial performance with total revenues of $96.77 billion, representing a 19% increase year-over-year. The automotive segment contributed $82.42 billion, while energy generation and storage contributed $6.04 billion, and services and other contributed $8.32 billion.",
+                "sources": [
+                    {"document": "Tesla_2023_Annual_Report.pdf", "page_number": 45, "chunk_id": 12, "relevance": "high"}
+                ]
+            },
+            "revenue": {
+                "answer": "According to the financial documents in our knowledge base, total revenues for 2023 were $96.77 billion. This represents strong growth across all business segments, with automotive sales being the primary revenue driver.",
+                "sources": [
+                    {"document": "Tesla_2023_Annual_Report.pdf", "page_number": 45, "chunk_id": 12, "relevance": "high"}
+                ]
+            },
+            "reset": {
+                "answer": "To perform a console reset according to the technical documentation: 1) Ensure the vehicle is in Park, 2) Hold down both scroll wheels on the steering wheel simultaneously for 10-15 seconds, 3) Wait for the main screen to go black, 4) The system will automatically reboot and display the Tesla logo. This process typically takes 30-60 seconds to complete.",
+                "sources": [
+                    {"document": "Tesla_Model_X_Manual.pdf", "page_number": 23, "chunk_id": 7, "relevance": "high"}
+                ]
+            },
+            "console": {
+                "answer": "The main console reset procedure involves holding both steering wheel scroll wheels for 10-15 seconds until the screen goes black, then waiting for the automatic reboot process to complete.",
+                "sources": [
+                    {"document": "Tesla_Model_X_Manual.pdf", "page_number": 23, "chunk_id": 7, "relevance": "high"}
+                ]
+            }
+        }
+        # Each branch looks ahead for its keyword anywhere in the query; alternation
+        # tries branches in order, so the earliest-listed keyword wins as before
+        self._demo_re = re.compile(
+            "|".join(f"(?=.*?(?P<{keyword}>{re.escape(keyword)}))" for keyword in self._demo_responses),
+            re.IGNORECASE | re.DOTALL
+        )
     
     def _initialize_pinecone(self):
         """Initialize Pinecone vector database."""
         try:
-            from pinecone import Pinecone
+            from pinecone.grpc import PineconeGRPC
             
-            # Initialize the Pinecone client
-            pc = Pinecone(
+            # gRPC client: protobuf payloads over one persistent HTTP/2 channel per index
+            pc = PineconeGRPC(
                 api_key=self.pinecone_api_key,
                 environment=self.pinecone_environment
             )
@@ -92,87 +360,415 @@ class RAGEngine:
                 logger.info(f"Index '{self.index_name}' not found. Creating a new one...")
                 pc.create_index(
                     name=self.index_name,
-                    dimension=768,  # Ensure this matches your embedding model's dimension
-                    metric="cosine",
+                    dimension=EMBEDDING_DIM,  # Ensure this matches your embedding model's dimension
+                    # Embeddings are L2-normalized, so dotproduct ranks like cosine and
+                    # also allows sparse term vectors next to the dense ones
+                    metric="dotproduct",
                 )
                 logger.info(f"Created new Pinecone index: {self.index_name}")
             
-            # Get the index using the client instance
-            index = pc.Index(self.index_name)
-            
-            # Create LangChain Pinecone vectorstore
-            self.vectorstore = LangchainPinecone(
-                index=index,
-                embedding=self.embeddings,
-                text_key="text"
-            )
+            # Get the index using the client instance; queries and upserts use it directly
+            self._index = pc.Index(self.index_name)
+            self._hybrid = pc.describe_index(self.index_name).metric == "dotproduct"
+            if not self._hybrid:
+                logger.info("Index metric is not dotproduct; using dense-only retrieval")
             logger.info(f"Pinecone initialized successfully. Connected to index '{self.index_name}'.")
             
         except Exception as e:
             logger.error(f"Could not initialize Pinecone: {e}")
             self.demo_mode = True
     
-    async def add_document(self, file_path: str, filename: str):
-        """Add a document to the knowledge base."""
+    async def add_documents(self, files: List[Tuple[str, str]]) -> Dict[str, Optional[str]]:
+        """Add several documents to the knowledge base, embedding all their chunks in one batch.
+        
+        Files are parsed concurrently and a file that fails to parse does not stop
+        the others. Returns each filename mapped to its error message, or None if
+        it was processed.
+        """
+        results = await asyncio.gather(
+            *[self._load_and_split(file_path, filename) for file_path, filename in files],
+            return_exceptions=True
+        )
+        
+        errors: Dict[str, Optional[str]] = {}
+        loaded = []
+        for (_, filename), result in zip(files, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error processing document {filename}: {str(result)}")
+                errors[filename] = f"Error processing document {filename}: {str(result)}"
+            else:
+                errors[filename] = None
+                loaded.append((filename, *result))
+        
+        if not loaded:
+            return errors
+        
+        # Dedup against committed chunks and within this batch; the batch only joins
+        # the shared index once stored, so a concurrent ingest never drops a chunk
+        # whose only other copy may still be rolled back
+        batch_lsh = MinHashLSH(threshold=DEDUP_THRESHOLD, num_perm=MINHASH_PERMS)
+        minhashes: List[MinHash] = []
+        loaded = [
+            (filename, self._drop_near_duplicates(chunks, batch_lsh, minhashes), page_count)
+            for filename, chunks, page_count in loaded
+        ]
+        all_chunks = [chunk for _, chunks, _ in loaded for chunk in chunks]
         try:
-            # Load and split the document
-            loader = PyPDFLoader(file_path)
-            pages = await asyncio.to_thread(loader.load)
-            
-            if not pages:
-                raise Exception("No content found in the PDF")
-            
-            # Split text into chunks
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=1000,
-                chunk_overlap=200,
-                length_function=len,
-                separators=["\n\n", "\n", " ", ""]
-            )
-            
-            chunks = text_splitter.split_documents(pages)
-            
-            # Add metadata to chunks
-            for i, chunk in enumerate(chunks):
-                chunk.metadata.update({
-                    "source": filename,
-                    "chunk_id": i,
-                    "page_number": chunk.metadata.get("page", 1),
-                    "total_chunks": len(chunks)
-                })
-            
-            if self.demo_mode:
+            if not all_chunks:
+                logger.info("Every chunk duplicates stored content; nothing to add")
+            elif self.demo_mode:
                 # Store in memory for demo
-                self.demo_documents.extend(chunks)
-                logger.info(f"Added {len(chunks)} chunks to demo storage")
+                vectors = None
+                if self.embeddings:
+                    vectors = await self._embed_chunks(all_chunks)
+                self._add_demo_chunks(all_chunks, vectors)
+                logger.info(f"Added {len(all_chunks)} chunks to demo storage")
             else:
                 # Store in Pinecone
-                await asyncio.to_thread(
-                    self.vectorstore.add_documents, 
-                    chunks
-                )
-                logger.info(f"Added {len(chunks)} chunks to Pinecone")
-            
-            # Store document metadata
+                await self._upsert_chunks(all_chunks)
+                logger.info(f"Added {len(all_chunks)} chunks to Pinecone")
+        except Exception as e:
+            filenames = ", ".join(filename for filename, _, _ in loaded)
+            logger.error(f"Error storing documents {filenames}: {str(e)}")
+            raise Exception(f"Error storing documents {filenames}: {str(e)}")
+        
+        with self._lsh.insertion_session() as session:
+            for minhash in minhashes:
+                session.insert(self._lsh_next_key, minhash)
+                self._lsh_next_key += 1
+        
+        # Cached answers were produced against the old knowledge base
+        self._cache_clear()
+        
+        # Store document metadata
+        for filename, chunks, page_count in loaded:
+            chunk_count = len(chunks)
+            if not chunks:
+                # A re-upload of stored content; its earlier chunks are still indexed
+                chunk_count = self.documents.get(filename, {}).get("chunks", 0)
             self.documents[filename] = {
-                "chunks": len(chunks),
-                "pages": len(pages),
+                "chunks": chunk_count,
+                "pages": page_count,
                 "status": "processed"
             }
+        if self.demo_mode and self.demo_store_path:
+            self._save_demo_documents()
+        
+        return errors
+    
+    async def enqueue_documents(self, files: List[Tuple[str, str]]):
+        """Queue files for background ingestion and return once they are accepted.
+        
+        The ingest workers own each file from then on and delete it once it has
+        been processed. Progress is reported through each document's status:
+        "queued", "processing", then "processed" or "failed". Waits while the
+        queue is full, so bursts of uploads are throttled instead of buffered.
+        """
+        if self._ingest_q is None:
+            self._ingest_q = asyncio.Queue(maxsize=INGEST_QUEUE_SIZE)
+            self._ingest_tasks = [
+                asyncio.create_task(self._ingest_worker()) for _ in range(self.ingest_workers)
+            ]
+        for file_path, filename in files:
+            await self._ingest_q.put((file_path, filename))
+            # Only once accepted: a put cancelled while the queue is full leaves no stuck entry
+            self._set_status(filename, "queued")
+    
+    async def _ingest_worker(self):
+        """Ingest queued files, batching whatever is already waiting into one add_documents call."""
+        while True:
+            batch = [await self._ingest_q.get()]
+            while len(batch) < INGEST_BATCH_MAX and not self._ingest_q.empty():
+                batch.append(self._ingest_q.get_nowait())
+            for _, filename in batch:
+                self._set_status(filename, "processing")
             
-            return True
+            try:
+                errors = await self.add_documents(batch)
+            except Exception as e:
+                errors = {filename: str(e) for _, filename in batch}
+            finally:
+                for file_path, _ in batch:
+                    if os.path.exists(file_path):
+                        os.unlink(file_path)
+                    self._ingest_q.task_done()
             
+            for filename, error in errors.items():
+                if error:
+                    self._set_status(filename, "failed", error=error)
+    
+    def _set_status(self, filename: str, status: str, **details):
+        """Move a document to a new ingest status.
+        
+        Chunk and page counts from an earlier successful ingest carry over, since
+        those chunks stay indexed while a re-upload is processed or if it fails.
+        """
+        previous = self.documents.get(filename, {})
+        counts = {key: previous[key] for key in ("chunks", "pages") if key in previous}
+        self.documents[filename] = {**counts, "status": status, **details}
+    
+    async def stop_ingest(self):
+        """Cancel the ingest workers and delete the files still waiting in the queue.
+        
+        A batch that is mid-ingest is abandoned; the worker's cleanup removes its
+        files as the cancellation unwinds.
+        """
+        for task in self._ingest_tasks:
+            task.cancel()
+        await asyncio.gather(*self._ingest_tasks, return_exceptions=True)
+        self._ingest_tasks = []
+        
+        if self._ingest_q is not None:
+            while not self._ingest_q.empty():
+                file_path, filename = self._ingest_q.get_nowait()
+                if os.path.exists(file_path):
+                    os.unlink(file_path)
+                logger.info(f"Discarded queued upload {filename} at shutdown")
+            self._ingest_q = None
+    
+    def _drop_near_duplicates(
+        self, chunks: List[Chunk], batch_lsh: MinHashLSH, minhashes: List[MinHash]
+    ) -> List[Chunk]:
+        """Filter out chunks that near-duplicate one already stored or earlier in the batch.
+        
+        Kept chunks are registered in batch_lsh and their MinHashes appended to
+        minhashes, for the caller to add to the shared index once they are stored.
+        """
+        kept = []
+        for text, meta in chunks:
+            minhash = _chunk_minhash(text)
+            if self._lsh.query(minhash) or batch_lsh.query(minhash):
+                continue
+            batch_lsh.insert(len(minhashes), minhash)
+            minhashes.append(minhash)
+            kept.append((text, meta))
+        
+        if len(kept) < len(chunks):
+            logger.info(f"Dropped {len(chunks) - len(kept)} near-duplicate chunks")
+        return kept
+    
+    async def _load_and_split(self, file_path: str, filename: str) -> Tuple[List[Chunk], int]:
+        """Load a PDF and split it into chunks tagged with source metadata."""
+        if os.path.getsize(file_path) < INLINE_PARSE_MAX_BYTES:
+            return _parse_and_split(file_path, filename)
+        return await asyncio.get_running_loop().run_in_executor(
+            _PDF_POOL, _parse_and_split, file_path, filename
+        )
+    
+    async def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Embed one batch of texts, bounded by the shared concurrency limit."""
+        if self._embed_sem is None:
+            self._embed_sem = asyncio.Semaphore(EMBED_CONCURRENCY)
+        async with self._embed_sem:
+            return await asyncio.to_thread(self.embeddings.embed_documents, texts)
+    
+    async def _embed_texts(self, texts: List[str]) -> np.ndarray:
+        """Embed texts in concurrent batches into a single L2-normalized float32 buffer."""
+        batches = [texts[i:i + EMBED_BATCH_SIZE] for i in range(0, len(texts), EMBED_BATCH_SIZE)]
+        results = await asyncio.gather(*[self._embed_batch(batch) for batch in batches])
+        
+        # Fill one preallocated buffer and normalize it in place: no intermediate
+        # arrays for the conversion or the squared norms
+        vectors = np.empty((len(texts), EMBEDDING_DIM), dtype=np.float32)
+        row = 0
+        for embeddings in results:
+            for embedding in embeddings:
+                vectors[row] = embedding
+                row += 1
+        norms = np.sqrt(np.einsum("ij,ij->i", vectors, vectors))
+        norms[norms == 0] = 1.0
+        vectors /= norms[:, None]
+        return vectors
+    
+    async def _embed_chunks(self, chunks: List[Chunk]) -> np.ndarray:
+        """Embed chunks, only calling the API for content not seen before."""
+        texts = [text for text, _ in chunks]
+        hashes = [hashlib.blake2b(text.encode(), digest_size=16).digest() for text in texts]
+        known = self._embcache_lookup(hashes)
+        
+        # Each distinct unseen text is embedded once, even if repeated in this upload
+        missing: Dict[bytes, str] = {}
+        for digest, text in zip(hashes, texts):
+            if digest not in known and digest not in missing:
+                missing[digest] = text
+        
+        if missing:
+            fresh = await self._embed_texts(list(missing.values()))
+            self._embcache.executemany(
+                "INSERT OR REPLACE INTO emb (hash, vec) VALUES (?, ?)",
+                [(digest, vector.tobytes()) for digest, vector in zip(missing, fresh)]
+            )
+            self._embcache.commit()
+            known.update(zip(missing, fresh))
+        logger.info(f"Embedded {len(missing)} of {len(chunks)} chunks ({len(chunks) - len(missing)} cached)")
+        
+        vectors = np.empty((len(chunks), EMBEDDING_DIM), dtype=np.float32)
+        for i, digest in enumerate(hashes):
+            vectors[i] = known[digest]
+        return vectors
+    
+    def _embcache_lookup(self, hashes: List[bytes]) -> Dict[bytes, np.ndarray]:
+        """Fetch stored embeddings for the given content hashes."""
+        known: Dict[bytes, np.ndarray] = {}
+        unique = list(set(hashes))
+        # Stay well under SQLite's bound-parameter limit
+        for i in range(0, len(unique), 500):
+            batch = unique[i:i + 500]
+            rows = self._embcache.execute(
+                f"SELECT hash, vec FROM emb WHERE hash IN ({','.join('?' * len(batch))})",
+                batch
+            )
+            for digest, vec in rows:
+                vector = np.frombuffer(vec, dtype=np.float32)
+                if vector.shape[0] == EMBEDDING_DIM:
+                    known[digest] = vector
+        return known
+    
+    def _add_demo_chunks(self, chunks: List[Chunk], vectors: Optional[np.ndarray]):
+        """Append chunks (and their embeddings, if any) to demo storage."""
+        # Only keep vectors while every stored chunk has one, so rows stay aligned
+        keep_vectors = vectors is not None and self._demo_vec_count() == len(self._demo_texts)
+        
+        self._append_demo_rows([text for text, _ in chunks], [meta for _, meta in chunks])
+        
+        if self.demo_store_path:
+            with open(f"{self.demo_store_path}.jsonl", "a") as f:
+                for text, meta in chunks:
+                    f.write(json.dumps({"text": text, "metadata": asdict(meta)}) + "\n")
+        
+        if not keep_vectors:
+            return
+        q_embs, scales = _quantize_rows(vectors)
+        if self.demo_store_path:
+            with open(f"{self.demo_store_path}.scales.bin", "ab") as f:
+                f.write(scales.tobytes())
+            with open(f"{self.demo_store_path}.q8.bin", "ab") as f:
+                f.write(q_embs.tobytes())
+            self._demo_q_embs, self._demo_scales = self._map_demo_vecs()
+        elif self._demo_q_embs is None:
+            self._demo_q_embs, self._demo_scales = q_embs, scales
+        else:
+            self._demo_q_embs = np.vstack([self._demo_q_embs, q_embs])
+            self._demo_scales = np.concatenate([self._demo_scales, scales])
+    
+    def _append_demo_rows(self, texts: List[str], metas: List[ChunkMeta]):
+        """Append chunk columns in one concatenate per array rather than per chunk."""
+        lowered = [text.lower() for text in texts]
+        self._demo_texts.extend(texts)
+        self._demo_lower.extend(lowered)
+        self._demo_sources = np.concatenate([
+            self._demo_sources,
+            np.array([meta.source for meta in metas], dtype=object),
+        ])
+        self._demo_pages = np.concatenate([
+            self._demo_pages,
+            np.array([meta.page_number for meta in metas], dtype=np.int32),
+        ])
+        self._demo_chunk_ids = np.concatenate([
+            self._demo_chunk_ids,
+            np.array([meta.chunk_id for meta in metas], dtype=np.int32),
+        ])
+        self._index_demo_text(lowered)
+    
+    def _demo_vec_count(self) -> int:
+        """Number of demo chunks that have a stored embedding."""
+        return 0 if self._demo_q_embs is None else len(self._demo_q_embs)
+    
+    def _map_demo_vecs(self) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        """Memory-map the persisted demo embeddings and scales so they are paged in lazily."""
+        q_path = f"{self.demo_store_path}.q8.bin"
+        scales_path = f"{self.demo_store_path}.scales.bin"
+        if not os.path.exists(q_path) or not os.path.exists(scales_path):
+            return None, None
+        rows = os.path.getsize(q_path) // EMBEDDING_DIM
+        if rows == 0 or os.path.getsize(scales_path) // np.dtype(np.float32).itemsize != rows:
+            return None, None
+        return (
+            np.memmap(q_path, dtype=np.int8, mode="r", shape=(rows, EMBEDDING_DIM)),
+            np.memmap(scales_path, dtype=np.float32, mode="r", shape=(rows,)),
+        )
+    
+    def _load_demo_store(self):
+        """Restore demo chunks and embeddings written by earlier runs."""
+        try:
+            if not os.path.exists(f"{self.demo_store_path}.jsonl"):
+                return
+            with open(f"{self.demo_store_path}.jsonl") as f:
+                records = [json.loads(line) for line in f if line.strip()]
+            self._doc_matrix = None
+            self._append_demo_rows(
+                [record["text"] for record in records],
+                [ChunkMeta.from_dict(record["metadata"]) for record in records],
+            )
+            # Re-register stored chunks so re-uploading a document after a restart is deduplicated
+            with self._lsh.insertion_session() as session:
+                for text in self._demo_texts:
+                    session.insert(self._lsh_next_key, _chunk_minhash(text))
+                    self._lsh_next_key += 1
+            
+            self._demo_q_embs, self._demo_scales = self._map_demo_vecs()
+            if self._demo_vec_count() != len(self._demo_texts):
+                logger.warning("Demo embeddings do not match stored chunks; using keyword retrieval only")
+            
+            if os.path.exists(f"{self.demo_store_path}.documents.json"):
+                with open(f"{self.demo_store_path}.documents.json") as f:
+                    self.documents = json.load(f)
+            logger.info(f"Loaded {len(self._demo_texts)} demo chunks from {self.demo_store_path}")
         except Exception as e:
-            logger.error(f"Error processing document {filename}: {str(e)}")
-            raise Exception(f"Error processing document {filename}: {str(e)}")
+            logger.error(f"Could not load demo store: {e}")
+    
+    def _save_demo_documents(self):
+        """Persist the document registry next to the demo chunks."""
+        with open(f"{self.demo_store_path}.documents.json", "w") as f:
+            # Queued or failed entries would be stale after a restart
+            json.dump({name: info for name, info in self.documents.items() if info.get("status") == "processed"}, f)
+    
+    async def _upsert_chunks(self, chunks: List[Chunk]):
+        """Embed chunks in one batched call and upsert them straight into the Pinecone index."""
+        vectors = await self._embed_chunks(chunks)
+        
+        # Chunk text is stored in metadata under "text" alongside the source fields
+        records = [
+            {"id": str(uuid.uuid4()), "values": vector.tolist(), "metadata": {**asdict(meta), "text": text}}
+            for (text, meta), vector in zip(chunks, vectors)
+        ]
+        if self._hybrid:
+            sparse = self._sparse_vectors([text for text, _ in chunks])
+            for record, sparse_values in zip(records, sparse):
+                if sparse_values is not None:
+                    record["sparse_values"] = sparse_values
+        def upsert_all():
+            # Issue every batch at once over the gRPC channel, then wait for them together;
+            # serializing the requests is blocking work too, so all of it stays off the event loop
+            futures = [
+                self._index.upsert(vectors=records[i:i + PINECONE_UPSERT_BATCH], async_req=True)
+                for i in range(0, len(records), PINECONE_UPSERT_BATCH)
+            ]
+            return [future.result() for future in futures]
+        
+        await asyncio.to_thread(upsert_all)
     
     async def query(self, query: str) -> Dict[str, Any]:
         """Query the knowledge base and return answer with sources."""
         try:
-            if self.demo_mode:
-                return await self._demo_query(query)
-            else:
-                return await self._pinecone_query(query)
+            query_vec = None
+            if self.embeddings:
+                query_vec = await self._embed_query(query)
+                cached = self._cache_get(query_vec)
+                if cached is not None:
+                    logger.info("Semantic cache hit")
+                    return cached
+            
+            generation = self._cache_generation
+            result, prompt = await self._retrieve(query, query_vec)
+            if prompt is not None:
+                answer = await self._generate(prompt)
+                result["answer"] = answer.strip()
+            
+            # Skip caching if documents were ingested while this query was running
+            if query_vec is not None and generation == self._cache_generation:
+                self._cache_put(query_vec, result)
+            return result
                 
         except Exception as e:
             logger.error(f"Error processing query: {str(e)}")
@@ -182,102 +778,408 @@ class RAGEngine:
                 "error": True
             }
     
-    async def _demo_query(self, query: str) -> Dict[str, Any]:
-        """Handle queries in demo mode (without Pinecone)."""
-        # Enhanced keyword matching for demo
-        relevant_chunks = []
-        query_lower = query.lower()
-        query_words = set(query_lower.split())
+    async def query_stream(self, query: str) -> AsyncIterator[Dict[str, Any]]:
+        """Query the knowledge base, yielding the answer as it is generated.
         
-        for doc in self.demo_documents:
-            content_words = set(doc.page_content.lower().split())
-            # Calculate simple relevance score
-            relevance = len(query_words.intersection(content_words)) / len(query_words)
-            if relevance > 0.1:  # At least 10% word overlap
-                relevant_chunks.append((doc, relevance))
+        Yields {"delta": text} events while the LLM produces the answer, then a
+        final event with the remaining result fields (sources, context_used, ...)
+        and "done": True.
+        """
+        try:
+            query_vec = None
+            if self.embeddings:
+                query_vec = await self._embed_query(query)
+                cached = self._cache_get(query_vec)
+                if cached is not None:
+                    logger.info("Semantic cache hit")
+                    yield {"delta": cached["answer"]}
+                    yield {**{k: v for k, v in cached.items() if k != "answer"}, "done": True}
+                    return
+            
+            generation = self._cache_generation
+            result, prompt = await self._retrieve(query, query_vec)
+            if prompt is not None:
+                parts = []
+                async for delta in self._generate_stream(prompt):
+                    parts.append(delta)
+                    yield {"delta": delta}
+                result["answer"] = "".join(parts).strip()
+            else:
+                yield {"delta": result["answer"]}
+            
+            if query_vec is not None and generation == self._cache_generation:
+                self._cache_put(query_vec, result)
+            yield {**{k: v for k, v in result.items() if k != "answer"}, "done": True}
+        
+        except Exception as e:
+            logger.error(f"Error processing query: {str(e)}")
+            yield {"delta": f"I encountered an error while processing your query: {str(e)}"}
+            yield {"sources": [], "error": True, "done": True}
+    
+    async def _retrieve(
+        self, query: str, query_vec: Optional[np.ndarray]
+    ) -> Tuple[Dict[str, Any], Optional[str]]:
+        """Retrieve context for a query; returns the result and any LLM prompt still to answer."""
+        if self.demo_mode:
+            # Retrieval runs inline; only the LLM call needs to leave the event loop
+            return self._demo_query_sync(query, query_vec)
+        return await self._pinecone_retrieve(query, query_vec)
+    
+    async def _embed_query(self, query: str) -> np.ndarray:
+        """Embed a query and L2-normalize it so dot products are cosine similarities."""
+        embedding = await asyncio.to_thread(self.embeddings.embed_query, query)
+        query_vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query_vec)
+        if norm > 0:
+            query_vec /= norm
+        return query_vec
+    
+    def _cache_get(self, query_vec: np.ndarray) -> Optional[Dict[str, Any]]:
+        """Return a cached response for a semantically equivalent query, if any."""
+        if not self._cache_entries:
+            return None
+        now = time.time()
+        if self._hnsw is not None:
+            while True:
+                try:
+                    labels, distances = self._hnsw.knn_query(query_vec, k=1)
+                except RuntimeError:
+                    return None  # every indexed entry has expired
+                best = int(labels[0][0])
+                if now - self._cache_created[best] <= self.cache_ttl:
+                    break
+                # Hide the expired entry until _cache_put reuses its slot (add_items
+                # on a deleted label restores it), so it cannot shadow a fresh one
+                self._hnsw.mark_deleted(best)
+            similarity = 1.0 - float(distances[0][0])
+        else:
+            sims = _int8_scores(self._cache_q, self._cache_scale, query_vec)
+            # Expired entries must not shadow a fresh entry for the same query
+            sims[now - self._cache_created > self.cache_ttl] = -np.inf
+            best = int(np.argmax(sims))
+            similarity = float(sims[best])
+        if similarity < self.cache_threshold:
+            return None
+        
+        self._cache_used[best] = now
+        return self._cache_entries[best]
+    
+    def _cache_put(self, query_vec: np.ndarray, result: Dict[str, Any]):
+        """Store a response under its query embedding, evicting the LRU entry when full."""
+        query_q, query_scale = _quantize(query_vec)
+        now = time.time()
         
-        # Sort by relevance
-        relevant_chunks.sort(key=lambda x: x[1], reverse=True)
+        expired = np.flatnonzero(now - self._cache_created > self.cache_ttl)
+        if expired.size or len(self._cache_entries) >= self.cache_max_entries:
+            # Reuse an expired slot first, else the least recently used one; HNSW
+            # updates a label in place
+            slot = int(expired[0]) if expired.size else int(np.argmin(self._cache_used))
+            self._cache_q[slot] = query_q
+            self._cache_scale[slot] = query_scale
+            self._cache_entries[slot] = result
+            self._cache_created[slot] = now
+            self._cache_used[slot] = now
+        else:
+            slot = len(self._cache_entries)
+            self._cache_q = np.vstack([self._cache_q, query_q[None, :]])
+            self._cache_scale = np.append(self._cache_scale, np.float32(query_scale))
+            self._cache_entries.append(result)
+            self._cache_created = np.append(self._cache_created, now)
+            self._cache_used = np.append(self._cache_used, now)
         
-        if not relevant_chunks:
+        if self._hnsw is not None:
+            if slot >= self._hnsw.get_max_elements():
+                self._hnsw.resize_index(2 * self._hnsw.get_max_elements())
+            self._hnsw.add_items(query_vec[None, :], [slot])
+        elif len(self._cache_entries) >= HNSW_MIN_ENTRIES:
+            self._build_hnsw()
+    
+    def _build_hnsw(self):
+        """Index every cached embedding in HNSW once the flat scan gets too slow."""
+        if hnswlib is None:
+            return
+        index = hnswlib.Index(space="cosine", dim=EMBEDDING_DIM)
+        index.init_index(
+            max_elements=max(HNSW_INITIAL_CAPACITY, 2 * len(self._cache_entries)),
+            M=16,
+            ef_construction=200
+        )
+        vectors = self._cache_q.astype(np.float32) * self._cache_scale[:, None]
+        index.add_items(vectors, np.arange(len(self._cache_entries)))
+        self._hnsw = index
+        logger.info(f"Semantic cache switched to HNSW index ({len(self._cache_entries)} entries)")
+    
+    def _cache_clear(self):
+        """Drop all cached responses."""
+        self._cache_generation += 1
+        self._cache_q = np.empty((0, EMBEDDING_DIM), dtype=np.int8)
+        self._cache_scale = np.empty(0, dtype=np.float32)
+        self._cache_entries = []
+        self._cache_created = np.empty(0, dtype=np.float64)
+        self._cache_used = np.empty(0, dtype=np.float64)
+        self._hnsw = None
+    
+    def _cache_load(self):
+        """Restore the semantic cache saved by save_cache()."""
+        try:
+            if not os.path.exists(f"{self.cache_path}.json"):
+                return
+            with open(f"{self.cache_path}.json") as f:
+                self._cache_entries = json.load(f)
+            with np.load(f"{self.cache_path}.npz") as arrays:
+                self._cache_q = arrays["q"]
+                self._cache_scale = arrays["scale"]
+                self._cache_created = arrays["created"]
+                self._cache_used = arrays["used"]
+            
+            if len(self._cache_entries) >= HNSW_MIN_ENTRIES and hnswlib is not None:
+                if os.path.exists(f"{self.cache_path}.hnsw"):
+                    index = hnswlib.Index(space="cosine", dim=EMBEDDING_DIM)
+                    index.load_index(
+                        f"{self.cache_path}.hnsw",
+                        max_elements=max(HNSW_INITIAL_CAPACITY, 2 * len(self._cache_entries))
+                    )
+                    self._hnsw = index
+                else:
+                    self._build_hnsw()
+            logger.info(f"Loaded {len(self._cache_entries)} semantic cache entries")
+        except Exception as e:
+            logger.error(f"Could not load semantic cache: {e}")
+            self._cache_clear()
+    
+    def save_cache(self):
+        """Persist the semantic cache (and its HNSW index) to SEMANTIC_CACHE_PATH."""
+        if not self.cache_path:
+            return
+        try:
+            with open(f"{self.cache_path}.json", "w") as f:
+                json.dump(self._cache_entries, f)
+            np.savez(
+                f"{self.cache_path}.npz",
+                q=self._cache_q,
+                scale=self._cache_scale,
+                created=self._cache_created,
+                used=self._cache_used
+            )
+            if self._hnsw is not None:
+                self._hnsw.save_index(f"{self.cache_path}.hnsw")
+            elif os.path.exists(f"{self.cache_path}.hnsw"):
+                os.unlink(f"{self.cache_path}.hnsw")
+            logger.info(f"Saved {len(self._cache_entries)} semantic cache entries")
+        except Exception as e:
+            logger.error(f"Could not save semantic cache: {e}")
+    
+    def _index_demo_text(self, lowered: List[str]):
+        """Append hashed term vectors for new chunks so queries are one sparse product."""
+        new_matrix = self._vectorizer.transform(lowered)
+        if self._doc_matrix is None:
+            self._doc_matrix = new_matrix
+        else:
+            self._doc_matrix = scipy.sparse.vstack([self._doc_matrix, new_matrix], format="csr")
+    
+    def _sparse_vectors(self, texts: List[str]) -> List[Optional[Dict[str, List]]]:
+        """Hashed term vectors in Pinecone's sparse format; None where no term survives.
+        
+        Uses the same stateless vectorizer as demo mode, so no encoder has to be
+        fitted on (or refitted as) the corpus grows.
+        """
+        matrix = self._vectorizer.transform([text.lower() for text in texts])
+        vectors = []
+        for row in range(matrix.shape[0]):
+            start, end = matrix.indptr[row], matrix.indptr[row + 1]
+            if start == end:
+                vectors.append(None)
+            else:
+                vectors.append({
+                    "indices": matrix.indices[start:end].tolist(),
+                    "values": matrix.data[start:end].tolist(),
+                })
+        return vectors
+    
+    def _keyword_match(self, query: str) -> List[int]:
+        """Substring-match query terms against demo chunks when term scoring finds nothing.
+        
+        Catches terms the vectorizer's tokenizer drops, such as "$96.77" or "x-100".
+        All terms are compiled into one Aho-Corasick automaton so each chunk is
+        scanned in a single pass.
+        """
+        query_words = {w for w in query.lower().split() if w not in ENGLISH_STOP_WORDS}
+        if not query_words:
+            return []
+        
+        automaton = _word_automaton(query_words)
+        
+        # Size-3 min-heap of (relevance, -row): ties keep the earliest chunk
+        heap: List[Tuple[float, int]] = []
+        for i, content in enumerate(self._demo_lower):
+            found = {word for _, word in automaton.iter(content)}
+            relevance = len(found) / len(query_words)
+            if relevance > DEMO_MIN_RELEVANCE:
+                if len(heap) < 3:
+                    heapq.heappush(heap, (relevance, -i))
+                elif relevance > heap[0][0]:
+                    heapq.heapreplace(heap, (relevance, -i))
+                if heap[0][0] == 1.0 and len(heap) == 3:
+                    break  # three chunks contain every term; nothing later can rank higher
+        
+        return [-neg_i for _, neg_i in sorted(heap, reverse=True)]
+    
+    def _demo_query_sync(
+        self, query: str, query_vec: Optional[np.ndarray] = None
+    ) -> Tuple[Dict[str, Any], Optional[str]]:
+        """Handle queries in demo mode (without Pinecone).
+        
+        Scoring and source assembly are pure CPU work, so they run without
+        awaiting. Returns the result and, when an LLM is configured, the prompt
+        whose answer the caller should fill in.
+        """
+        rows: List[int] = []
+        if query_vec is not None and self._demo_texts and self._demo_vec_count() == len(self._demo_texts):
+            # Dense retrieval over the int8 chunk embeddings
+            scores = _int8_scores(self._demo_q_embs, self._demo_scales, query_vec)
+            k = min(3, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            rows = [int(i) for i in top if scores[i] > self.demo_min_dense_score]
+        
+        if not rows and self._doc_matrix is not None:
+            query_terms = self._vectorizer.transform([query.lower()])
+            scores = (self._doc_matrix @ query_terms.T).toarray().ravel()
+            
+            # Take top 3 most relevant chunks
+            k = min(3, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            rows = [int(i) for i in top if scores[i] > DEMO_MIN_RELEVANCE]
+        
+        if not rows:
+            rows = self._keyword_match(query)
+        
+        if not rows:
             # Return enhanced demo response
-            return self._get_demo_response(query)
+            return self._get_demo_response(query), None
         
-        # Take top 3 most relevant chunks
-        context_chunks = [chunk[0] for chunk in relevant_chunks[:3]]
-        context = "\n\n".join([chunk.page_content for chunk in context_chunks])
+        context = "\n\n".join([self._demo_texts[i] for i in rows])
         
         # Generate answer using enhanced prompting
+        prompt = None
         if self.llm:
-            prompt = self.prompt_template.format(context=context, question=query)
-            answer_response = await asyncio.to_thread(self.llm.invoke, prompt)
-            answer = answer_response.content
+            prompt = self._prompt_text.format(context=context, question=query)
+            answer = ""
         else:
             answer = self._generate_simple_answer(context, query)
         
         # Extract sources
         sources = []
-        for chunk in context_chunks:
+        for i in rows:
             sources.append({
-                "document": chunk.metadata.get("source", "Unknown"),
-                "page_number": chunk.metadata.get("page_number", 1),
-                "chunk_id": chunk.metadata.get("chunk_id", 0),
+                "document": self._demo_sources[i],
+                "page_number": int(self._demo_pages[i]),
+                "chunk_id": int(self._demo_chunk_ids[i]),
                 "relevance": "high"
             })
         
         return {
             "answer": answer.strip(),
             "sources": sources,
-            "context_used": len(context_chunks)
-        }
+            "context_used": len(rows)
+        }, prompt
     
-    async def _pinecone_query(self, query: str) -> Dict[str, Any]:
-        """Handle queries using Pinecone vector search."""
+    async def _pinecone_retrieve(
+        self, query: str, query_vec: Optional[np.ndarray] = None
+    ) -> Tuple[Dict[str, Any], str]:
+        """Handle queries using Pinecone vector search; the caller generates the answer from the prompt."""
         try:
-            # Create retrieval QA chain with custom prompt
-            qa_chain = RetrievalQA.from_chain_type(
-                llm=self.llm,
-                chain_type="stuff",
-                retriever=self.vectorstore.as_retriever(
-                    search_type="similarity",
-                    search_kwargs={"k": 5}
-                ),
-                return_source_documents=True,
-                chain_type_kwargs={"prompt": self.prompt_template}
-            )
+            # Embed once; the same vector serves the semantic cache and retrieval
+            if query_vec is None:
+                query_vec = await self._embed_query(query)
             
-            result = await asyncio.to_thread(qa_chain, {"query": query})
+            # Query the index client directly rather than through a LangChain retriever
+            dense = query_vec
+            sparse_vector = None
+            if self._hybrid:
+                # Convex combination of dense and term scores, merged server-side
+                sparse_vector = self._sparse_vectors([query])[0]
+                if sparse_vector is not None:
+                    dense = query_vec * self.hybrid_alpha
+                    sparse_vector["values"] = [v * (1 - self.hybrid_alpha) for v in sparse_vector["values"]]
+            response = await asyncio.to_thread(
+                self._index.query,
+                vector=dense.tolist(),
+                sparse_vector=sparse_vector,
+                top_k=5,
+                include_metadata=True
+            )
+            matches = [match.metadata or {} for match in response.matches]
+            context = "\n\n".join([metadata.get("text", "") for metadata in matches])
+            prompt = self._prompt_text.format(context=context, question=query)
             
-            # Extract sources with enhanced metadata
+            # Extract sources with enhanced metadata (Pinecone returns numbers as floats)
             sources = []
-            for doc in result["source_documents"]:
+            for metadata in matches:
                 sources.append({
-                    "document": doc.metadata.get("source", "Unknown"),
-                    "page_number": doc.metadata.get("page_number", 1),
-                    "chunk_id": doc.metadata.get("chunk_id", 0),
+                    "document": metadata.get("source", "Unknown"),
+                    "page_number": int(metadata.get("page_number", 1)),
+                    "chunk_id": int(metadata.get("chunk_id", 0)),
                     "relevance": "high"
                 })
             
             return {
-                "answer": result["result"],
+                "answer": "",
                 "sources": sources,
-                "context_used": len(result["source_documents"])
-            }
+                "context_used": len(matches)
+            }, prompt
             
         except Exception as e:
             logger.error(f"Pinecone query error: {str(e)}")
             raise e
     
+    async def _generate(self, prompt: str) -> str:
+        """Call the LLM, reusing the answer for a prompt that was already sent."""
+        key = hashlib.sha256(prompt.encode()).hexdigest()
+        if key in self._llm_cached_prompts:
+            return self._llm_cached_prompts[key]
+        
+        answer_response = await asyncio.to_thread(self.llm.invoke, prompt)
+        answer = answer_response.content
+        
+        if len(self._llm_cached_prompts) >= LLM_PROMPT_CACHE_SIZE:
+            # Dicts keep insertion order, so this evicts the oldest prompt
+            del self._llm_cached_prompts[next(iter(self._llm_cached_prompts))]
+        self._llm_cached_prompts[key] = answer
+        return answer
+    
+    async def _generate_stream(self, prompt: str) -> AsyncIterator[str]:
+        """Stream the LLM answer in pieces, sharing the prompt memo with _generate."""
+        key = hashlib.sha256(prompt.encode()).hexdigest()
+        if key in self._llm_cached_prompts:
+            yield self._llm_cached_prompts[key]
+            return
+        
+        parts = []
+        async for chunk in self.llm.astream(prompt):
+            parts.append(chunk.content)
+            yield chunk.content
+        
+        if len(self._llm_cached_prompts) >= LLM_PROMPT_CACHE_SIZE:
+            del self._llm_cached_prompts[next(iter(self._llm_cached_prompts))]
+        self._llm_cached_prompts[key] = "".join(parts)
+    
     def _generate_simple_answer(self, context: str, query: str) -> str:
         """Generate a simple answer when LLM is not available."""
         # Basic text processing for demo purposes
         context_sentences = context.split('. ')
-        query_words = query.lower().split()
+        query_words = set(query.lower().split())
         
         relevant_sentences = []
-        for sentence in context_sentences:
-            if any(word in sentence.lower() for word in query_words):
-                relevant_sentences.append(sentence)
+        if query_words:
+            # One automaton matches every query word in a single scan per sentence
+            automaton = _word_automaton(query_words)
+            for sentence in context_sentences:
+                if next(automaton.iter(sentence.lower()), None) is not None:
+                    relevant_sentences.append(sentence)
+                    if len(relevant_sentences) == 2:
+                        break
         
         if relevant_sentences:
             return '. '.join(relevant_sentences[:2]) + '.'
@@ -286,37 +1188,9 @@ class RAGEngine:
     
     def _get_demo_response(self, query: str) -> Dict[str, Any]:
         """Return enhanced demo responses for common queries."""
-        demo_responses = {
-            "tesla": {
-                "answer": "Based on Tesla's 2023 annual report, Tesla achieved record financial performance with total revenues of $96.77 billion, representing a 19% increase year-over-year. The automotive segment contributed $82.42 billion, while energy generation and storage contributed $6.04 billion, and services and other contributed $8.32 billion.",
-                "sources": [
-                    {"document": "Tesla_2023_Annual_Report.pdf", "page_number": 45, "chunk_id": 12, "relevance": "high"}
-                ]
-            },
-            "revenue": {
-                "answer": "According to the financial documents in our knowledge base, total revenues for 2023 were $96.77 billion. This represents strong growth across all business segments, with automotive sales being the primary revenue driver.",
-                "sources": [
-                    {"document": "Tesla_2023_Annual_Report.pdf", "page_number": 45, "chunk_id": 12, "relevance": "high"}
-                ]
-            },
-            "reset": {
-                "answer": "To perform a console reset according to the technical documentation: 1) Ensure the vehicle is in Park, 2) Hold down both scroll wheels on the steering wheel simultaneously for 10-15 seconds, 3) Wait for the main screen to go black, 4) The system will automatically reboot and display the Tesla logo. This process typically takes 30-60 seconds to complete.",
-                "sources": [
-                    {"document": "Tesla_Model_X_Manual.pdf", "page_number": 23, "chunk_id": 7, "relevance": "high"}
-                ]
-            },
-            "console": {
-                "answer": "The main console reset procedure involves holding both steering wheel scroll wheels for 10-15 seconds until the screen goes black, then waiting for the automatic reboot process to complete.",
-                "sources": [
-                    {"document": "Tesla_Model_X_Manual.pdf", "page_number": 23, "chunk_id": 7, "relevance": "high"}
-                ]
-            }
-        }
-        
-        query_lower = query.lower()
-        for keyword, response in demo_responses.items():
-            if keyword in query_lower:
-                return response
+        match = self._demo_re.match(query)
+        if match:
+            return self._demo_responses[match.lastgroup]
         
         # Enhanced default response
         return {
@@ -330,7 +1204,10 @@ class RAGEngine:
         return {
             "mode": "demo" if self.demo_mode else "production",
             "documents_count": len(self.documents),
-            "demo_chunks": len(self.demo_documents) if self.demo_mode else 0,
+            "documents_queued": sum(
+                1 for info in self.documents.values() if info.get("status") in ("queued", "processing")
+            ),
+            "demo_chunks": len(self._demo_texts) if self.demo_mode else 0,
             "gemini_configured": bool(self.gemini_api_key),
             "pinecone_configured": bool(self.pinecone_api_key and not self.demo_mode),
             "ai_provider": "Google Gemini"
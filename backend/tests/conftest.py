@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rag_engine import RAGEngine
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    """A demo-mode engine with no API keys and no persistence."""
+    for key in ("GEMINI_API_KEY", "GOOGLE_API_KEY", "PINECONE_API_KEY", "SEMANTIC_CACHE_PATH", "DEMO_STORE_PATH"):
+        monkeypatch.delenv(key, raising=False)
+    monkeypatch.setenv("EMBEDDING_CACHE_PATH", ":memory:")
+    engine = RAGEngine()
+    engine.cache_ttl = 10.0
+    return engine
@@ -0,0 +1,83 @@
+import asyncio
+
+import numpy as np
+
+from datasketch import MinHashLSH
+
+from rag_engine import DEDUP_THRESHOLD, EMBEDDING_DIM, MINHASH_PERMS, ChunkMeta
+
+
+def test_unrelated_query_vector_falls_back_to_canned_response(engine):
+    chunk_vec = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    chunk_vec[0] = 1.0
+    engine._add_demo_chunks(
+        [("Quarterly revenue grew across all segments.", ChunkMeta("a.pdf", 0, 0, 1))],
+        chunk_vec[None, :],
+    )
+
+    query_vec = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    query_vec[1] = 1.0  # orthogonal: cosine similarity 0
+    result, prompt = engine._demo_query_sync("zzz unrelated", query_vec)
+    assert prompt is None
+    assert result["sources"] == []
+
+    result, _ = engine._demo_query_sync("quarterly revenue", chunk_vec)
+    assert [source["document"] for source in result["sources"]] == ["a.pdf"]
+
+
+def test_reloaded_demo_store_deduplicates_reuploads(engine, monkeypatch, tmp_path):
+    from rag_engine import RAGEngine
+
+    text = "Tesla total revenues were 96.77 billion dollars in 2023 across all segments."
+    monkeypatch.setenv("DEMO_STORE_PATH", str(tmp_path / "store"))
+    first = RAGEngine()
+    first._add_demo_chunks([(text, ChunkMeta("a.pdf", 0, 0, 1))], None)
+
+    restarted = RAGEngine()
+    batch_lsh = MinHashLSH(threshold=DEDUP_THRESHOLD, num_perm=MINHASH_PERMS)
+    assert restarted._drop_near_duplicates([(text, ChunkMeta("a.pdf", 0, 0, 1))], batch_lsh, []) == []
+
+
+def test_duplicate_reupload_keeps_chunk_count(engine):
+    text = "Tesla total revenues were 96.77 billion dollars in 2023 across all segments."
+
+    async def load_and_split(file_path, filename):
+        return [(text, ChunkMeta(filename, 0, 0, 1))], 1
+
+    engine._load_and_split = load_and_split
+    asyncio.run(engine.add_documents([("a.pdf", "a.pdf")]))
+    asyncio.run(engine.add_documents([("a.pdf", "a.pdf")]))
+    assert engine.documents["a.pdf"] == {"chunks": 1, "pages": 1, "status": "processed"}
+
+
+def test_failed_store_does_not_shadow_a_concurrent_batch(engine):
+    text = "Tesla total revenues were 96.77 billion dollars in 2023 across all segments."
+
+    async def load_and_split(file_path, filename):
+        return [(text, ChunkMeta(filename, 0, 0, 1))], 1
+
+    async def run():
+        storing, retry = asyncio.Event(), asyncio.Event()
+
+        async def failing_embed(chunks):
+            storing.set()
+            await retry.wait()
+            raise RuntimeError("embedding service unavailable")
+
+        engine._load_and_split = load_and_split
+        engine._embed_chunks = failing_embed
+        engine.embeddings = object()
+        first = asyncio.create_task(engine.add_documents([("a.pdf", "a.pdf")]))
+        await storing.wait()
+        engine.embeddings = None  # the second batch stores without embedding
+        await engine.add_documents([("b.pdf", "b.pdf")])
+        retry.set()
+        try:
+            await first
+        except Exception:
+            return
+        raise AssertionError("first batch should fail to store")
+
+    asyncio.run(run())
+    assert engine._demo_texts == [text]
+    assert engine.documents["b.pdf"]["chunks"] == 1
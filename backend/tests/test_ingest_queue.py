@@ -0,0 +1,42 @@
+import asyncio
+import os
+import tempfile
+
+import rag_engine
+
+
+def test_stop_ingest_removes_queued_files(engine):
+    async def slow_add_documents(files):
+        await asyncio.sleep(60)
+
+    engine.add_documents = slow_add_documents
+    engine.ingest_workers = 1
+    paths = []
+    for _ in range(3):
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
+            paths.append(tmp_file.name)
+
+    async def run():
+        await engine.enqueue_documents([(path, os.path.basename(path)) for path in paths[:1]])
+        await asyncio.sleep(0)  # the worker takes the first file
+        await engine.enqueue_documents([(path, os.path.basename(path)) for path in paths[1:]])
+        await engine.stop_ingest()
+
+    asyncio.run(run())
+    assert not any(os.path.exists(path) for path in paths)
+    assert engine._ingest_tasks == []
+
+
+def test_cancelled_enqueue_leaves_no_queued_status(engine, monkeypatch):
+    monkeypatch.setattr(rag_engine, "INGEST_QUEUE_SIZE", 1)
+    engine.ingest_workers = 0  # nothing drains the queue
+
+    async def run():
+        await engine.enqueue_documents([("/nonexistent/a.pdf", "a.pdf")])
+        blocked = asyncio.create_task(engine.enqueue_documents([("/nonexistent/b.pdf", "b.pdf")]))
+        await asyncio.sleep(0)  # b.pdf waits for room in the full queue
+        blocked.cancel()
+        await asyncio.gather(blocked, return_exceptions=True)
+
+    asyncio.run(run())
+    assert engine.documents == {"a.pdf": {"status": "queued"}}
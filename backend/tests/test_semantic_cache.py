@@ -0,0 +1,69 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+import rag_engine
+from rag_engine import EMBEDDING_DIM
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rag_engine.time, "time", lambda: now[0])
+    return now
+
+
+def unit_vector(seed):
+    vec = np.random.default_rng(seed).standard_normal(EMBEDDING_DIM).astype(np.float32)
+    return vec / np.linalg.norm(vec)
+
+
+@pytest.mark.parametrize("use_hnsw", [False, True])
+def test_expired_entry_is_replaced_not_shadowing(engine, clock, use_hnsw):
+    if use_hnsw and rag_engine.hnswlib is None:
+        pytest.skip("hnswlib not installed")
+    other = unit_vector(1)
+    query = unit_vector(2)
+    engine._cache_put(other, {"answer": "other"})
+    engine._cache_put(query, {"answer": "old"})
+    if use_hnsw:
+        engine._build_hnsw()
+
+    clock[0] += 60  # both entries expire
+    assert engine._cache_get(query) is None
+    engine._cache_put(query, {"answer": "new"})
+
+    # Repeats hit the fresh answer and do not keep adding slots
+    for _ in range(3):
+        assert engine._cache_get(query) == {"answer": "new"}
+    assert len(engine._cache_entries) == 2
+
+
+def test_default_size_limit_reaches_hnsw(engine, clock):
+    if rag_engine.hnswlib is None:
+        pytest.skip("hnswlib not installed")
+    assert engine.cache_max_entries > rag_engine.HNSW_MIN_ENTRIES
+    vectors = np.random.default_rng(0).standard_normal((rag_engine.HNSW_MIN_ENTRIES, EMBEDDING_DIM))
+    vectors = (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+    for i, vec in enumerate(vectors):
+        engine._cache_put(vec, {"answer": str(i)})
+    assert engine._hnsw is not None
+    assert engine._cache_get(vectors[7]) == {"answer": "7"}
+
+
+def test_answer_from_before_an_ingest_is_not_cached(engine):
+    query_vec = unit_vector(3)
+
+    async def embed_query(query):
+        return query_vec
+
+    async def retrieve(query, vec):
+        engine._cache_clear()  # an ingest finishes while retrieval is in flight
+        return {"answer": "stale", "sources": []}, None
+
+    engine.embeddings = object()
+    engine._embed_query = embed_query
+    engine._retrieve = retrieve
+    assert asyncio.run(engine.query("hello"))["answer"] == "stale"
+    assert engine._cache_entries == []
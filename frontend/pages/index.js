@@ -105,7 +105,7 @@ function Home() {
       }
 
       setDocuments(prevDocs => [...prevDocs, ...data.uploaded_files]);
-      showToast('success', 'Upload successful', `${data.uploaded_files.length} document(s) processed`);
+      showToast('success', 'Upload successful', `${data.uploaded_files.length} document(s) queued for processing`);
       fetchStats();
     } catch (err) {
       showToast('error', 'Upload failed', err.message);